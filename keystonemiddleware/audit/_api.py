@@ -11,7 +11,9 @@
 # under the License.
 
 import collections
-import re
+import functools
+import os
+import types
 
 from oslo_log import log as logging
 from oslo_serialization import jsonutils
@@ -28,6 +30,8 @@ import six
 from six.moves import configparser
 from six.moves.urllib import parse as urlparse
 
+from keystonemiddleware.audit import _fast_ini
+
 # NOTE(blk-u): Compatibility for Python 2. SafeConfigParser and
 # SafeConfigParser.readfp are deprecated in Python 3. Remove this when we drop
 # support for Python 2.
@@ -50,6 +54,28 @@ AuditMap = collections.namedtuple('AuditMap',
                                    'default_target_endpoint_type'])
 
 
+# NOTE: Bound once at import as they are used for every audited request.
+_A_CREATE = taxonomy.ACTION_CREATE
+_A_DELETE = taxonomy.ACTION_DELETE
+_A_LIST = taxonomy.ACTION_LIST
+_A_READ = taxonomy.ACTION_READ
+_A_UPDATE = taxonomy.ACTION_UPDATE
+_UNKNOWN = taxonomy.UNKNOWN
+
+# Actions of the request methods whose action does not depend on the path.
+_METHOD_ACTIONS = {
+    'PUT': _A_UPDATE,
+    'PATCH': _A_UPDATE,
+    'DELETE': _A_DELETE,
+    'HEAD': _A_READ,
+}
+
+# Target service used when the request cannot be matched to the catalog.
+_UNKNOWN_SERVICE = Service(type=_UNKNOWN, name=_UNKNOWN, id=_UNKNOWN,
+                           admin_endp=None, private_endp=None,
+                           public_endp=None)
+
+
 class PycadfAuditApiConfigError(Exception):
     """Error raised when pyCADF fails to configure correctly."""
 
@@ -75,59 +101,170 @@ class KeystoneCredential(credential.Credential):
             self.identity_status = identity_status
 
 
+def _parse_audit_map_compat(text):
+    """Parse audit map file contents into an AuditMap using ConfigParser."""
+    path_kw = {}
+    custom_actions = {}
+    endpoints = {}
+    default_target_endpoint_type = None
+
+    try:
+        map_conf = _ConfigParser()
+        map_conf.read_string(text)
+
+        try:
+            default_target_endpoint_type = map_conf.get(
+                'DEFAULT', 'target_endpoint_type')
+        except configparser.NoOptionError:  # nosec
+            # Ignore the undefined config option,
+            # default_target_endpoint_type remains None which is valid.
+            pass
+
+        try:
+            custom_actions = dict(map_conf.items('custom_actions'))
+        except configparser.Error:  # nosec
+            # custom_actions remains {} which is valid.
+            pass
+
+        try:
+            path_kw = dict(map_conf.items('path_keywords'))
+        except configparser.Error:  # nosec
+            # path_kw remains {} which is valid.
+            pass
+
+        try:
+            endpoints = dict(map_conf.items('service_endpoints'))
+        except configparser.Error:  # nosec
+            # endpoints remains {} which is valid.
+            pass
+    except configparser.ParsingError as err:
+        raise PycadfAuditApiConfigError(
+            'Error parsing audit map file: %s' % err)
+
+    return AuditMap(
+        path_kw=path_kw, custom_actions=custom_actions,
+        service_endpoints=endpoints,
+        default_target_endpoint_type=default_target_endpoint_type)
+
+
+def _parse_audit_map(cfg_file):
+    """Parse an audit map file into an AuditMap."""
+    with open(cfg_file) as f:
+        text = f.read()
+
+    try:
+        sections = _fast_ini.parse(text)
+    except _fast_ini.UnsupportedSyntax:
+        # NOTE: The file uses INI features beyond plain sections and
+        # key/value pairs, let ConfigParser handle (or reject) it.
+        return _parse_audit_map_compat(text)
+
+    return AuditMap(
+        path_kw=sections.get('path_keywords', {}),
+        custom_actions=sections.get('custom_actions', {}),
+        service_endpoints=sections.get('service_endpoints', {}),
+        default_target_endpoint_type=sections.get(
+            _fast_ini.DEFAULT_SECTION, {}).get('target_endpoint_type'))
+
+
+# NOTE: Parsed audit maps keyed by file path. The middleware is constructed
+# once per worker and on every reload, so avoid re-parsing a map that has not
+# changed. Cached maps are shared by every middleware using the file, so their
+# mappings are stored read-only.
+_MAP_CACHE = {}
+
+
+def _load_audit_map(cfg_file):
+    """Return the AuditMap for cfg_file, parsing it only when it changed."""
+    if not cfg_file:
+        return AuditMap(path_kw={}, custom_actions={}, service_endpoints={},
+                        default_target_endpoint_type=None)
+
+    st = os.stat(cfg_file)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _MAP_CACHE.get(cfg_file)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    audit_map = _parse_audit_map(cfg_file)
+    audit_map = audit_map._replace(
+        path_kw=types.MappingProxyType(audit_map.path_kw),
+        custom_actions=types.MappingProxyType(audit_map.custom_actions),
+        service_endpoints=types.MappingProxyType(
+            audit_map.service_endpoints))
+    _MAP_CACHE[cfg_file] = (stamp, audit_map)
+    return audit_map
+
+
+_CatalogIndex = collections.namedtuple('_CatalogIndex',
+                                       ['by_netloc', 'by_type', 'skipped'])
+
+
+# NOTE: The service catalog header is identical for every request made with
+# the same token, and usually for a whole project, so keep the index of
+# recently seen catalogs. The returned objects are shared and must not be
+# modified.
+@functools.lru_cache(maxsize=128)
+def _index_catalog(catalog):
+    """Parse a service catalog and index its services.
+
+    Services are indexed by the netloc of their admin and public urls, where
+    the first service using a netloc wins as when scanning the catalog in
+    order, and by type, where the last service of a type wins. Services
+    without endpoints are returned as (position, name) pairs so they can be
+    reported; netloc entries also record the service's position for this.
+    """
+    by_netloc = {}
+    by_type = {}
+    skipped = []
+    for position, endp in enumerate(jsonutils.loads(catalog)):
+        if not endp['endpoints']:
+            skipped.append((position, endp['name']))
+            continue
+        endpoint_urls = endp['endpoints'][0]
+        for url_key in ('adminURL', 'publicURL'):
+            netloc = urlparse.urlparse(endpoint_urls.get(url_key, '')).netloc
+            if netloc:
+                by_netloc.setdefault(netloc, (position, endp))
+        by_type[endp['type']] = endp
+
+    return _CatalogIndex(by_netloc=by_netloc, by_type=by_type,
+                         skipped=tuple(skipped))
+
+
+# NOTE: A service only sees requests for a handful of host urls, so remember
+# the netloc parsed from recent ones.
+@functools.lru_cache(maxsize=128)
+def _host_netloc(host_url):
+    """Return the netloc of a host url if it has a port, else None."""
+    url = urlparse.urlparse(host_url)
+    return url.netloc if url.port else None
+
+
 class OpenStackAuditApi(object):
 
     def __init__(self, cfg_file, log=logging.getLogger(__name__)):
         """Configure to recognize and map known api paths."""
-        path_kw = {}
-        custom_actions = {}
-        endpoints = {}
-        default_target_endpoint_type = None
-
-        if cfg_file:
-            try:
-                map_conf = _ConfigParser()
-                map_conf.read_file(open(cfg_file))
-
-                try:
-                    default_target_endpoint_type = map_conf.get(
-                        'DEFAULT', 'target_endpoint_type')
-                except configparser.NoOptionError:  # nosec
-                    # Ignore the undefined config option,
-                    # default_target_endpoint_type remains None which is valid.
-                    pass
-
-                try:
-                    custom_actions = dict(map_conf.items('custom_actions'))
-                except configparser.Error:  # nosec
-                    # custom_actions remains {} which is valid.
-                    pass
-
-                try:
-                    path_kw = dict(map_conf.items('path_keywords'))
-                except configparser.Error:  # nosec
-                    # path_kw remains {} which is valid.
-                    pass
-
-                try:
-                    endpoints = dict(map_conf.items('service_endpoints'))
-                except configparser.Error:  # nosec
-                    # endpoints remains {} which is valid.
-                    pass
-            except configparser.ParsingError as err:
-                raise PycadfAuditApiConfigError(
-                    'Error parsing audit map file: %s' % err)
-
         self._log = log
-        self._MAP = AuditMap(
-            path_kw=path_kw, custom_actions=custom_actions,
-            service_endpoints=endpoints,
-            default_target_endpoint_type=default_target_endpoint_type)
+        self._MAP = _load_audit_map(cfg_file)
+        self._path_kw_set = frozenset(self._MAP.path_kw)
+
+        # NOTE: Split custom actions into those bound to a request method,
+        # e.g. "os-migrations/get", and plain ones so get_action can look
+        # them up without building a composite key for every request.
+        self._ca_method = {}
+        self._ca_plain = {}
+        for key, value in self._MAP.custom_actions.items():
+            if '/' in key:
+                url_ending, _sep, method = key.rpartition('/')
+                self._ca_method[(url_ending, method.upper())] = value
+            else:
+                self._ca_plain[key] = value
 
     @staticmethod
     def _clean_path(value):
         """Clean path if path has json suffix."""
-        return value[:-5] if value.endswith('.json') else value
+        return value[:-5] if value[-5:] == '.json' else value
 
     def get_action(self, req):
         """Take a given Request, parse url path to calculate action type.
@@ -151,61 +288,75 @@ class OpenStackAuditApi(object):
         if HEAD, assume read action.
 
         """
-        path = req.path[:-1] if req.path.endswith('/') else req.path
-        url_ending = self._clean_path(path[path.rfind('/') + 1:])
+        ca_method = self._ca_method
+        ca_plain = self._ca_plain
+        path_kw_set = self._path_kw_set
+
+        # NOTE: req.path is rebuilt and url quoted by webob on every access,
+        # so only evaluate it once. The last path segment, without a
+        # trailing slash or json suffix, is located by index and sliced out
+        # once instead of building intermediate strings.
+        path = req.path
+        end = len(path)
+        if end and path[end - 1] == '/':
+            end -= 1
+        start = path.rfind('/', 0, end) + 1
+        if end - start >= 5 and path.startswith('.json', end - 5, end):
+            end -= 5
+        url_ending = path[start:end]
         method = req.method
 
-        if url_ending + '/' + method.lower() in self._MAP.custom_actions:
-            action = self._MAP.custom_actions[url_ending + '/' +
-                                              method.lower()]
-        elif url_ending in self._MAP.custom_actions:
-            action = self._MAP.custom_actions[url_ending]
-        elif method == 'POST':
+        action = ca_method.get((url_ending, method))
+        if action is not None:
+            return action
+        action = ca_plain.get(url_ending)
+        if action is not None:
+            return action
+
+        if method == 'POST':
             if url_ending == 'action':
-                try:
-                    if req.json:
-                        body_action = list(req.json.keys())[0]
-                        action = taxonomy.ACTION_UPDATE + '/' + body_action
-                    else:
-                        action = taxonomy.ACTION_CREATE
-                except ValueError:
-                    action = taxonomy.ACTION_CREATE
-            elif url_ending not in self._MAP.path_kw:
-                action = taxonomy.ACTION_UPDATE
+                action = _A_CREATE
+                # NOTE: req.json decodes the body on every access, so do it
+                # once and only when there is a body to decode.
+                if req.is_body_readable:
+                    try:
+                        body = req.json
+                    except ValueError:
+                        body = None
+                    if body:
+                        body_action = next(iter(body))
+                        action = _A_UPDATE + '/' + body_action
+            elif url_ending not in path_kw_set:
+                action = _A_UPDATE
             else:
-                action = taxonomy.ACTION_CREATE
+                action = _A_CREATE
         elif method == 'GET':
-            if url_ending in self._MAP.path_kw:
-                action = taxonomy.ACTION_LIST
+            if url_ending in path_kw_set:
+                action = _A_LIST
             else:
-                action = taxonomy.ACTION_READ
-        elif method == 'PUT' or method == 'PATCH':
-            action = taxonomy.ACTION_UPDATE
-        elif method == 'DELETE':
-            action = taxonomy.ACTION_DELETE
-        elif method == 'HEAD':
-            action = taxonomy.ACTION_READ
+                action = _A_READ
         else:
-            action = taxonomy.UNKNOWN
+            action = _METHOD_ACTIONS.get(method, _UNKNOWN)
 
         return action
 
     def _get_service_info(self, endp):
+        endpoint_urls = endp['endpoints'][0]
         service = Service(
             type=self._MAP.service_endpoints.get(
                 endp['type'],
-                taxonomy.UNKNOWN),
+                _UNKNOWN),
             name=endp['name'],
-            id=endp['endpoints'][0].get('id', endp['name']),
+            id=endpoint_urls.get('id', endp['name']),
             admin_endp=endpoint.Endpoint(
                 name='admin',
-                url=endp['endpoints'][0].get('adminURL', taxonomy.UNKNOWN)),
+                url=endpoint_urls.get('adminURL', _UNKNOWN)),
             private_endp=endpoint.Endpoint(
                 name='private',
-                url=endp['endpoints'][0].get('internalURL', taxonomy.UNKNOWN)),
+                url=endpoint_urls.get('internalURL', _UNKNOWN)),
             public_endp=endpoint.Endpoint(
                 name='public',
-                url=endp['endpoints'][0].get('publicURL', taxonomy.UNKNOWN)))
+                url=endpoint_urls.get('publicURL', _UNKNOWN)))
 
         return service
 
@@ -214,22 +365,30 @@ class OpenStackAuditApi(object):
 
         Combines service type and corresponding path for greater detail.
         """
-        type_uri = ''
-        prev_key = None
-        for key in re.split('/', req.path):
-            key = self._clean_path(key)
-            if key in self._MAP.path_kw:
-                type_uri += '/' + key
-            elif prev_key in self._MAP.path_kw:
-                type_uri += '/' + self._MAP.path_kw[prev_key]
-            prev_key = key
-        return service_type + type_uri
+        path_kw = self._MAP.path_kw
+        if not path_kw:
+            return service_type
+
+        clean_path = self._clean_path
+        parts = [service_type]
+        # NOTE: Path keyword values are always strings, so None marks a
+        # segment that is not a keyword and each segment is looked up once.
+        prev_value = None
+        for key in req.path.split('/'):
+            key = clean_path(key)
+            value = path_kw.get(key)
+            if value is not None:
+                parts.append(key)
+            elif prev_value is not None:
+                parts.append(prev_value)
+            prev_value = value
+        return '/'.join(parts)
 
     def _build_target(self, req, service):
         """Build target resource."""
         target_typeURI = (
             self._build_typeURI(req, service.type)
-            if service.type != taxonomy.UNKNOWN else service.type)
+            if service.type != _UNKNOWN else service.type)
         target = resource.Resource(typeURI=target_typeURI,
                                    id=service.id, name=service.name)
         if service.admin_endp:
@@ -247,14 +406,10 @@ class OpenStackAuditApi(object):
         from service catalog. If not, the information will be taken from
         given config file.
         """
-        service_info = Service(type=taxonomy.UNKNOWN, name=taxonomy.UNKNOWN,
-                               id=taxonomy.UNKNOWN, admin_endp=None,
-                               private_endp=None, public_endp=None)
+        service_info = _UNKNOWN_SERVICE
 
-        catalog = {}
-        try:
-            catalog = jsonutils.loads(req.environ['HTTP_X_SERVICE_CATALOG'])
-        except KeyError:
+        catalog = req.environ.get('HTTP_X_SERVICE_CATALOG')
+        if catalog is None:
             self._log.warning(
                 'Unable to discover target information because '
                 'service catalog is missing. Either the incoming '
@@ -263,30 +418,27 @@ class OpenStackAuditApi(object):
                 'the latter, please make sure the '
                 '"include_service_catalog" property in '
                 'auth_token middleware is set to "True"')
+            return self._build_target(req, service_info)
+
+        index = _index_catalog(catalog)
+        netloc = _host_netloc(req.host_url)
+        match = index.by_netloc.get(netloc) if netloc else None
 
-        default_endpoint = None
-        for endp in catalog:
-            if not endp['endpoints']:
-                self._log.warning(
-                    'Skipping service %s as it have no endpoints.',
-                    endp['name'])
-                continue
-            endpoint_urls = endp['endpoints'][0]
-            admin_urlparse = urlparse.urlparse(
-                endpoint_urls.get('adminURL', ''))
-            public_urlparse = urlparse.urlparse(
-                endpoint_urls.get('publicURL', ''))
-            req_url = urlparse.urlparse(req.host_url)
-            if req_url.port and (req_url.netloc == admin_urlparse.netloc
-                                 or req_url.netloc == public_urlparse.netloc):
-                service_info = self._get_service_info(endp)
+        # NOTE: Only report the services that a scan of the catalog in order
+        # would have passed before reaching the matched service.
+        for position, name in index.skipped:
+            if match is not None and position > match[0]:
                 break
-            elif (self._MAP.default_target_endpoint_type and
-                  endp['type'] == self._MAP.default_target_endpoint_type):
-                default_endpoint = endp
-        else:
-            if default_endpoint:
-                service_info = self._get_service_info(default_endpoint)
+            self._log.warning(
+                'Skipping service %s as it have no endpoints.', name)
+
+        endp = None
+        if match is not None:
+            endp = match[1]
+        elif self._MAP.default_target_endpoint_type:
+            endp = index.by_type.get(self._MAP.default_target_endpoint_type)
+        if endp is not None:
+            service_info = self._get_service_info(endp)
         return self._build_target(req, service_info)
 
     def _create_event(self, req):
@@ -295,14 +447,14 @@ class OpenStackAuditApi(object):
 
         initiator = ClientResource(
             typeURI=taxonomy.ACCOUNT_USER,
-            id=req.environ.get('HTTP_X_USER_ID', taxonomy.UNKNOWN),
-            name=req.environ.get('HTTP_X_USER_NAME', taxonomy.UNKNOWN),
+            id=req.environ.get('HTTP_X_USER_ID', _UNKNOWN),
+            name=req.environ.get('HTTP_X_USER_NAME', _UNKNOWN),
             host=host.Host(address=req.client_addr, agent=req.user_agent),
             credential=KeystoneCredential(
                 token=req.environ.get('HTTP_X_AUTH_TOKEN', ''),
                 identity_status=req.environ.get('HTTP_X_IDENTITY_STATUS',
-                                                taxonomy.UNKNOWN)),
-            project_id=req.environ.get('HTTP_X_PROJECT_ID', taxonomy.UNKNOWN),
+                                                _UNKNOWN)),
+            project_id=req.environ.get('HTTP_X_PROJECT_ID', _UNKNOWN),
             request_id=req.environ.get('openstack.request_id'),
             global_request_id=req.environ.get('openstack.global_request_id'))
 
@@ -0,0 +1,79 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Minimal parser for the flat INI files used as audit maps.
+
+Audit maps only contain ``[section]`` headers and ``key = value`` lines, so
+the interpolation, continuation lines and other features of ConfigParser are
+never used. Anything outside of that subset raises UnsupportedSyntax and the
+caller is expected to fall back to ConfigParser, which keeps the existing
+behaviour and error reporting for such files.
+"""
+
+import re
+
+SECTION_RE = re.compile(r'^\[([^\]]+)\]\s*$')
+KV_RE = re.compile(r'^([^=:\s\[][^=:]*?)\s*=\s*(.*)$')
+
+DEFAULT_SECTION = 'DEFAULT'
+
+
+class UnsupportedSyntax(Exception):
+    """Raised for input that needs to be handled by ConfigParser."""
+
+    pass
+
+
+def parse(text):
+    """Parse INI text into a ``{section: {key: value}}`` dict.
+
+    As with ConfigParser, keys are lower cased and the values of the
+    ``DEFAULT`` section are also visible in every other section.
+    """
+    sections = {}
+    current = None
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped[0] in '#;':
+            continue
+        if line[0].isspace():
+            # Possibly a continuation line.
+            raise UnsupportedSyntax(line)
+
+        match = SECTION_RE.match(line)
+        if match:
+            name = match.group(1)
+            if name in sections:
+                raise UnsupportedSyntax(line)
+            current = sections[name] = {}
+            continue
+
+        match = KV_RE.match(line)
+        if match is None or current is None:
+            raise UnsupportedSyntax(line)
+        key = match.group(1).lower()
+        value = match.group(2).strip()
+        if key in current or '%' in value:
+            # Duplicate options and interpolation.
+            raise UnsupportedSyntax(line)
+        current[key] = value
+
+    defaults = sections.get(DEFAULT_SECTION)
+    if defaults:
+        for name, options in sections.items():
+            if name != DEFAULT_SECTION:
+                merged = dict(defaults)
+                merged.update(options)
+                sections[name] = merged
+
+    return sections
@@ -10,12 +10,15 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import operator
+from unittest import mock
 import uuid
 
 from pycadf import cadftaxonomy as taxonomy
 import webob
 
 from keystonemiddleware import audit
+from keystonemiddleware.audit import _api
 from keystonemiddleware.tests.unit.audit import base
 
 
@@ -109,6 +112,17 @@ class AuditApiLogicTest(base.BaseAuditMiddlewareTest):
         self.assertEqual(payload['target']['typeURI'],
                          'service/compute/servers')
 
+    def test_get_no_path_keywords(self):
+        with open(self.audit_map, "w") as f:
+            f.write("[service_endpoints]\n")
+            f.write("compute = service/compute")
+
+        url = 'http://admin_host:8774/v2/' + str(uuid.uuid4()) + '/servers'
+        payload = self.get_payload('GET', url)
+
+        self.assertEqual(payload['action'], 'read')
+        self.assertEqual(payload['target']['typeURI'], 'service/compute')
+
     def test_put(self):
         url = 'http://admin_host:8774/v2/' + str(uuid.uuid4()) + '/servers'
         payload = self.get_payload('PUT', url)
@@ -174,6 +188,29 @@ class AuditApiLogicTest(base.BaseAuditMiddlewareTest):
         self.assertEqual(payload['action'], 'create')
         self.assertEqual(payload['outcome'], 'pending')
 
+    def test_post_invalid_body_action(self):
+        url = 'http://admin_host:8774/v2/%s/servers/action' % uuid.uuid4().hex
+        payload = self.get_payload('POST', url, body=b'not json')
+
+        self.assertEqual(payload['target']['typeURI'],
+                         'service/compute/servers/action')
+        self.assertEqual(payload['action'], 'create')
+        self.assertEqual(payload['outcome'], 'pending')
+
+    def test_get_action_override(self):
+        class CustomAuditApi(audit.OpenStackAuditApi):
+            def get_action(self, req):
+                return taxonomy.ACTION_EVALUATE
+
+        url = 'http://admin_host:8774/v2/' + str(uuid.uuid4()) + '/servers'
+        req = webob.Request.blank(url,
+                                  method='GET',
+                                  environ=self.get_environ_header(),
+                                  remote_addr='192.168.0.1')
+        payload = CustomAuditApi(self.audit_map)._create_event(req).as_dict()
+
+        self.assertEqual(payload['action'], taxonomy.ACTION_EVALUATE)
+
     def test_custom_action(self):
         url = 'http://admin_host:8774/v2/%s/os-hosts/%s/reboot' % (
             uuid.uuid4().hex, uuid.uuid4().hex)
@@ -320,6 +357,36 @@ class AuditApiLogicTest(base.BaseAuditMiddlewareTest):
         payload = self.get_payload('GET', url, environ=env_headers)
         self.assertEqual(payload['target']['name'], "unknown")
 
+    def _get_skipped_service_payload(self, services):
+        compute = '''{"endpoints_links": [],
+                      "endpoints": [{"adminURL": "http://admin_host:8774",
+                                     "publicURL": "http://public_host:8774",
+                                     "id": "resource_id"}],
+                      "type": "compute",
+                      "name": "nova"}'''
+        empty = '''{"endpoints_links": [],
+                    "endpoints": [],
+                    "type": "foo",
+                    "name": "bar"}'''
+        catalog = [compute if s == 'compute' else empty for s in services]
+        env_headers = {'HTTP_X_SERVICE_CATALOG': '[%s]' % ','.join(catalog),
+                       'REQUEST_METHOD': 'GET'}
+
+        url = 'http://admin_host:8774/v2/' + str(uuid.uuid4()) + '/servers'
+        return self.get_payload('GET', url, environ=env_headers)
+
+    def test_service_with_no_endpoints_before_match(self):
+        payload = self._get_skipped_service_payload(['empty', 'compute'])
+
+        self.assertEqual(payload['target']['name'], 'nova')
+        self.assertIn('Skipping service bar', self.logger.output)
+
+    def test_service_with_no_endpoints_after_match(self):
+        payload = self._get_skipped_service_payload(['compute', 'empty'])
+
+        self.assertEqual(payload['target']['name'], 'nova')
+        self.assertNotIn('Skipping service bar', self.logger.output)
+
     def test_endpoint_no_service_port(self):
         with open(self.audit_map, "w") as f:
             f.write("[DEFAULT]\n")
@@ -417,3 +484,79 @@ class AuditApiLogicTest(base.BaseAuditMiddlewareTest):
 
         self.assertNotIn('request_id', payload['initiator'])
         self.assertNotIn('global_request_id', payload['initiator'])
+
+    def test_endpoint_matched_by_public_url(self):
+        env_headers = {'HTTP_X_SERVICE_CATALOG':
+                       '''[{"endpoints_links": [],
+                            "endpoints": [{"adminURL":
+                                           "http://admin_host:9292",
+                                           "publicURL":
+                                           "http://public_host:9292",
+                                           "id": "image_id"}],
+                            "type": "image",
+                            "name": "glance"},
+                           {"endpoints_links": [],
+                            "endpoints": [{"adminURL":
+                                           "http://admin_host:8774",
+                                           "publicURL":
+                                           "http://public_host:8774",
+                                           "id": "compute_id"}],
+                            "type": "compute",
+                            "name": "nova"}]''',
+                       'REQUEST_METHOD': 'GET'}
+
+        url = 'http://public_host:8774/v2/' + str(uuid.uuid4()) + '/servers'
+        payload = self.get_payload('GET', url, environ=env_headers)
+        self.assertEqual(payload['target']['name'], 'nova')
+        self.assertEqual(payload['target']['id'], 'compute_id')
+        self.assertEqual(payload['target']['typeURI'],
+                         'service/compute/servers')
+
+    def test_service_catalog_parsed_once(self):
+        env_headers = self.get_environ_header('GET')
+        env_headers['HTTP_X_SERVICE_CATALOG'] = (
+            env_headers['HTTP_X_SERVICE_CATALOG'].replace(
+                'resource_id', uuid.uuid4().hex))
+        url = 'http://admin_host:8774/v2/' + str(uuid.uuid4()) + '/servers'
+
+        with mock.patch.object(_api.jsonutils, 'loads',
+                               wraps=_api.jsonutils.loads) as loads:
+            payload1 = self.get_payload('GET', url, environ=env_headers)
+            payload2 = self.get_payload('GET', url, environ=env_headers)
+
+        loads.assert_called_once_with(env_headers['HTTP_X_SERVICE_CATALOG'])
+        self.assertEqual(payload1['target'], payload2['target'])
+
+
+class AuditMapLoadTest(base.BaseAuditMiddlewareTest):
+
+    def test_audit_map_reused(self):
+        api1 = audit.OpenStackAuditApi(self.audit_map)
+        api2 = audit.OpenStackAuditApi(self.audit_map)
+
+        self.assertIs(api1._MAP, api2._MAP)
+        self.assertEqual('server', api1._MAP.path_kw['servers'])
+
+    def test_audit_map_read_only(self):
+        api = audit.OpenStackAuditApi(self.audit_map)
+
+        self.assertRaises(TypeError, operator.setitem, api._MAP.path_kw,
+                          'hosts', 'host')
+        self.assertRaises(TypeError, operator.setitem,
+                          api._MAP.custom_actions, 'shutdown', 'stop')
+        self.assertRaises(TypeError, operator.setitem,
+                          api._MAP.service_endpoints, 'image',
+                          'service/image')
+
+    def test_audit_map_reloaded_on_change(self):
+        api1 = audit.OpenStackAuditApi(self.audit_map)
+
+        with open(self.audit_map, "w") as f:
+            f.write("[path_keywords]\n")
+            f.write("loadbalancers = loadbalancer\n")
+
+        api2 = audit.OpenStackAuditApi(self.audit_map)
+
+        self.assertIsNot(api1._MAP, api2._MAP)
+        self.assertEqual({'loadbalancers': 'loadbalancer'},
+                         api2._MAP.path_kw)
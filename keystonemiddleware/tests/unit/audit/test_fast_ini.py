@@ -0,0 +1,82 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from oslotest import createfile
+
+from keystonemiddleware.audit import _api
+from keystonemiddleware.audit import _fast_ini
+from keystonemiddleware.tests.unit.audit import base
+from keystonemiddleware.tests.unit import utils
+
+
+class FastIniTest(utils.BaseTestCase):
+
+    def test_parse(self):
+        sections = _fast_ini.parse("# comment\n"
+                                   "[custom_actions]\n"
+                                   "Reboot = start/reboot\n"
+                                   "; comment\n"
+                                   "\n"
+                                   "[path_keywords]\n"
+                                   "servers=server\n"
+                                   "action =\n")
+
+        self.assertEqual({'custom_actions': {'reboot': 'start/reboot'},
+                          'path_keywords': {'servers': 'server',
+                                            'action': ''}},
+                         sections)
+
+    def test_parse_defaults(self):
+        sections = _fast_ini.parse("[DEFAULT]\n"
+                                   "target_endpoint_type = compute\n"
+                                   "[path_keywords]\n"
+                                   "servers = server\n")
+
+        self.assertEqual({'target_endpoint_type': 'compute'},
+                         sections['DEFAULT'])
+        self.assertEqual({'target_endpoint_type': 'compute',
+                          'servers': 'server'},
+                         sections['path_keywords'])
+
+    def test_parse_unsupported(self):
+        for text in ("servers = server\n",
+                     "[path_keywords]\nservers = server\n  continued\n",
+                     "[path_keywords]\nservers: server\n",
+                     "[path_keywords]\nservers = %(server)s\n",
+                     "[path_keywords]\nservers = a\nservers = b\n",
+                     "[path_keywords]\n[path_keywords]\n"):
+            self.assertRaises(_fast_ini.UnsupportedSyntax,
+                              _fast_ini.parse, text)
+
+
+class FastIniAuditMapTest(base.BaseAuditMiddlewareTest):
+
+    def test_matches_configparser(self):
+        with open(self.audit_map) as f:
+            text = f.read()
+
+        self.assertEqual(_api._parse_audit_map_compat(text),
+                         _api._parse_audit_map(self.audit_map))
+
+    def test_unsupported_falls_back(self):
+        audit_map = self.useFixture(createfile.CreateFileWithContent(
+            'audit', "[path_keywords]\nservers: server\n")).path
+
+        self.assertEqual({'servers': 'server'},
+                         _api._parse_audit_map(audit_map).path_kw)
+
+    def test_parsing_error(self):
+        audit_map = self.useFixture(createfile.CreateFileWithContent(
+            'audit', "servers = server\n")).path
+
+        self.assertRaises(_api.PycadfAuditApiConfigError,
+                          _api._parse_audit_map, audit_map)